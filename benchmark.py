@@ -0,0 +1,655 @@
+"""End-to-end benchmark harness for the SwiftyDB API.
+
+Starts server.py against local PostgreSQL, MongoDB and Neo4j instances (see
+docker-compose.bench.yml) and a stub Spotify server, seeds the databases from
+the bundled zip datasets, drives every API endpoint at one or more concurrency
+levels and reports p50/p95/p99 latency and throughput. Results can be saved as
+a baseline and later runs compared against it.
+
+Example:
+    docker compose -f docker-compose.bench.yml up -d
+    python benchmark.py --concurrency 1 8 --save-baseline
+    python benchmark.py --concurrency 1 8
+"""
+
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import psycopg2
+import requests
+from psycopg2.extras import execute_values
+from pymongo import MongoClient
+from neo4j import GraphDatabase
+
+from feature_store import FEATURES, FeatureStore
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TAYLOR_SWIFT_ZIP = os.path.join(REPO_DIR, "taylor_swift.zip")
+CHART_ZIP = os.path.join(REPO_DIR, "1970_2005data.zip")
+
+
+# Datasets
+
+
+def _read_zipped_csv(zip_path, member):
+    with zipfile.ZipFile(zip_path) as archive:
+        with archive.open(member) as raw:
+            return list(csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8")))
+
+
+def load_taylor_swift_songs():
+    """
+    This function reads taylor_swift_spotify.csv from taylor_swift.zip.
+    It returns a list of dicts with the song name, album, release date, Spotify id,
+    the nine audio features and the duration.
+    """
+    songs = []
+    for row in _read_zipped_csv(TAYLOR_SWIFT_ZIP, "taylor_swift_spotify.csv"):
+        song = {
+            "id": row["id"],
+            "name": row["name"],
+            "album": row["album"],
+            "release_date": row["release_date"],
+            "duration_ms": int(row["duration_ms"]),
+        }
+        song.update({feature: float(row[feature]) for feature in FEATURES})
+        songs.append(song)
+    return songs
+
+
+def load_chart_songs():
+    """
+    This function joins the chart and audio feature tables from 1970_2005data.zip on the track id.
+    It returns one dict per unique track with the name, artists, a release date derived from the
+    chart year, the nine audio features and the duration.
+    """
+    features_by_id = {
+        row["id"]: row
+        for row in _read_zipped_csv(CHART_ZIP, "1970_2005data/audio_features.xls")
+    }
+    songs = {}
+    for row in _read_zipped_csv(CHART_ZIP, "1970_2005data/chart_data_of_features.xls"):
+        features = features_by_id.get(row["track_id"])
+        if features is None or row["track_id"] in songs:
+            continue
+        song = {
+            "id": row["track_id"],
+            "name": row["track"],
+            "artists": row["artist"],
+            "release_date": f"{row['year']}-01-01",
+            "duration_ms": int(features["duration_ms"]),
+        }
+        song.update({feature: float(features[feature]) for feature in FEATURES})
+        songs[song["id"]] = song
+    return list(songs.values())
+
+
+# Seeding
+
+
+def seed_postgres(conn, catalog, taylor_swift_songs):
+    """
+    This function (re)creates the `songs` and `ts_table` tables in the `project` schema
+    and fills them from the chart catalog and the Taylor Swift dataset.
+    """
+    feature_columns = ", ".join(f"{feature} REAL" for feature in FEATURES)
+    feature_names = ", ".join(FEATURES)
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS project;")
+        cursor.execute("DROP TABLE IF EXISTS project.songs, project.ts_table;")
+        cursor.execute(f"""CREATE TABLE project.songs (
+                song_id SERIAL PRIMARY KEY, name TEXT, artists TEXT, release_date DATE,
+                {feature_columns}, duration_ms INTEGER);""")
+        cursor.execute(f"""CREATE TABLE project.ts_table (
+                name TEXT, album TEXT, release_date DATE,
+                {feature_columns}, duration_ms INTEGER);""")
+        execute_values(
+            cursor,
+            f"INSERT INTO project.songs (name, artists, release_date, {feature_names}, duration_ms) VALUES %s",
+            [
+                (song["name"], song["artists"], song["release_date"])
+                + tuple(song[feature] for feature in FEATURES)
+                + (song["duration_ms"],)
+                for song in catalog
+            ],
+        )
+        execute_values(
+            cursor,
+            f"INSERT INTO project.ts_table (name, album, release_date, {feature_names}, duration_ms) VALUES %s",
+            [
+                (song["name"], song["album"], song["release_date"])
+                + tuple(song[feature] for feature in FEATURES)
+                + (song["duration_ms"],)
+                for song in taylor_swift_songs
+            ],
+        )
+    conn.commit()
+
+
+def seed_mongo(database):
+    """This function empties the playlists and stored recommendations so every run starts from the same state."""
+    database["playlists"].delete_many({})
+    database["playlist_recommendations"].delete_many({})
+
+
+def seed_neo4j(driver, taylor_swift_songs):
+    """This function replaces all :Song nodes with the Taylor Swift dataset."""
+    properties = ["name"] + FEATURES
+    rows = [{key: song[key] for key in properties} for song in taylor_swift_songs]
+    with driver.session() as session:
+        session.run("MATCH (song:Song) DETACH DELETE song")
+        session.run("UNWIND $rows AS row CREATE (song:Song) SET song = row", rows=rows)
+
+
+# Stub Spotify server
+
+
+class StubSpotifyHandler(BaseHTTPRequestHandler):
+    """
+    Answers the three Spotify Web API calls made by server.py (token, search and
+    audio-features) from the chart catalog, without any network access.
+    """
+
+    catalog = []
+    catalog_by_id = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/api/token":
+            self._send_json(
+                {"access_token": "stub", "token_type": "Bearer", "expires_in": 3600}
+            )
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/v1/search":
+            self._send_json(self._search(parse_qs(url.query)))
+        elif url.path.startswith("/v1/audio-features/"):
+            song = self.catalog_by_id.get(url.path.rsplit("/", 1)[-1])
+            if song is None:
+                self._send_json({"error": "not found"}, 404)
+            else:
+                features = {feature: song[feature] for feature in FEATURES}
+                features.update({"id": song["id"], "duration_ms": song["duration_ms"]})
+                self._send_json(features)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _search(self, params):
+        query = params.get("q", [""])[0]
+        limit = int(params.get("limit", ["5"])[0])
+        track = query.partition("track:")[2].strip().lower()
+        artist = query.partition("artist:")[2].partition(" track:")[0].strip().lower()
+        items = []
+        for song in self.catalog:
+            if track in song["name"].lower() and artist in song["artists"].lower():
+                items.append(
+                    {
+                        "id": song["id"],
+                        "name": song["name"],
+                        "album": {"release_date": song["release_date"]},
+                        "artists": [{"name": song["artists"]}],
+                    }
+                )
+                if len(items) >= limit:
+                    break
+        return {"tracks": {"items": items}}
+
+
+@contextmanager
+def run_stub_spotify(catalog, port=0):
+    """This context manager serves StubSpotifyHandler in a background thread and yields its base URL."""
+    handler = type(
+        "CatalogSpotifyHandler",
+        (StubSpotifyHandler,),
+        {"catalog": catalog, "catalog_by_id": {song["id"]: song for song in catalog}},
+    )
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_port}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+# Application server
+
+
+@contextmanager
+def run_server(port, env_overrides, pg_user, pg_password, timeout=30):
+    """
+    This context manager starts the Flask app from server.py in a subprocess.
+    It runs in a temporary working directory holding a generated config.py and
+    credentials.txt, so the developer's real credentials are never touched.
+    It yields the base URL once the server answers requests.
+    """
+    with tempfile.TemporaryDirectory(prefix="swiftydb-bench-") as workdir:
+        with open(os.path.join(workdir, "config.py"), "w") as file1:
+            file1.write('client_id = "bench"\nclient_secret = "bench"\n')
+        with open(os.path.join(workdir, "credentials.txt"), "w") as file1:
+            file1.write(f"{pg_user}\n{pg_password}\n")
+
+        env = os.environ.copy()
+        env.update(env_overrides)
+        env["PYTHONPATH"] = os.pathsep.join(
+            path for path in (REPO_DIR, env.get("PYTHONPATH")) if path
+        )
+        command = (
+            "import sys; from server import app; "
+            "app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"
+        )
+        process = subprocess.Popen(
+            [sys.executable, "-c", command, str(port)],
+            cwd=workdir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            wait_for_server(base_url, process, timeout)
+            yield base_url
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def wait_for_server(base_url, process=None, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            requests.get(f"{base_url}/", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not start within {timeout}s")
+
+
+# Load generation
+
+
+def _db_row(song):
+    # Shape of a row returned by /api/search-songs
+    return [song["name"], song["artists"], song["release_date"]]
+
+
+def _playlist_entry(song):
+    return {
+        "name": song["name"],
+        "artists": song["artists"].split(","),
+        "release_date": song["release_date"],
+    }
+
+
+def _search_songs_request(rng, catalog):
+    song = rng.choice(catalog)
+    return {"params": {"song": song["name"][:4], "artist": ""}}
+
+
+def _search_spotify_request(rng, catalog):
+    song = rng.choice(catalog)
+    return {"params": {"song": song["name"], "artist": song["artists"]}}
+
+
+def _spotify_track_request(rng, catalog):
+    song = rng.choice(catalog)
+    return {
+        "json": {
+            "id": song["id"],
+            "name": song["name"],
+            "release_date": song["release_date"],
+            "artists": [song["artists"]],
+        }
+    }
+
+
+def _db_row_request(rng, catalog):
+    return {"json": _db_row(rng.choice(catalog))}
+
+
+def _playlist_entry_request(rng, catalog):
+    return {"json": _playlist_entry(rng.choice(catalog))}
+
+
+def _no_payload(rng, catalog):
+    return {}
+
+
+# Added to and removed from the playlist before each timed request of
+# get-taylor-swift-playlist-recompute: the playlist ends up unchanged, but its
+# stored recommendations are pending, so the timed request runs the pipeline.
+TOGGLE_SONG = {
+    "name": "swiftydb benchmark toggle",
+    "artists": "swiftydb",
+    "release_date": "2000-01-01",
+}
+
+
+def _recompute_request(rng, catalog):
+    return {"toggle": TOGGLE_SONG}
+
+
+def _toggle_playlist_song(base_url, client, song):
+    client.post(f"{base_url}/api/add-to-playlist", json=_db_row(song))
+    client.post(f"{base_url}/api/delete-from-playlist", json=_playlist_entry(song))
+
+
+# Endpoint name -> (HTTP method, path, function building the request kwargs).
+# Mutating endpoints come last so reads see the seeded playlists.
+ENDPOINTS = {
+    "search-songs": ("GET", "/api/search-songs", _search_songs_request),
+    "taylor-swift-recommendations": (
+        "POST",
+        "/api/taylor-swift-recommendations",
+        _db_row_request,
+    ),
+    "search-spotify": ("GET", "/api/search-spotify", _search_spotify_request),
+    "get-playlist": ("GET", "/api/get-playlist", _no_payload),
+    "get-taylor-swift-playlist": (
+        "GET",
+        "/api/get-taylor-swift-playlist",
+        _no_payload,
+    ),
+    # Same endpoint with the stored recommendations invalidated before every request
+    "get-taylor-swift-playlist-recompute": (
+        "GET",
+        "/api/get-taylor-swift-playlist",
+        _recompute_request,
+    ),
+    "add-spotify-song": ("POST", "/api/add-spotify-song", _spotify_track_request),
+    "add-to-playlist": ("POST", "/api/add-to-playlist", _db_row_request),
+    "delete-from-playlist": (
+        "POST",
+        "/api/delete-from-playlist",
+        _playlist_entry_request,
+    ),
+}
+
+
+def make_client(base_url, playlist):
+    """
+    This function opens a session against the server (which assigns a user_id)
+    and adds the given songs to that user's playlist. Setup requests are not timed.
+    """
+    client = requests.Session()
+    client.get(f"{base_url}/").raise_for_status()
+    for song in playlist:
+        client.post(f"{base_url}/api/add-to-playlist", json=_db_row(song))
+    return client
+
+
+def _run_jobs(base_url, client, method, path, jobs):
+    samples = []
+    for kwargs in jobs:
+        if "toggle" in kwargs:
+            # Untimed setup request, see TOGGLE_SONG
+            kwargs = dict(kwargs)
+            _toggle_playlist_song(base_url, client, kwargs.pop("toggle"))
+        start = time.perf_counter()
+        try:
+            response = client.request(method, f"{base_url}{path}", timeout=60, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        samples.append((time.perf_counter() - start, ok))
+    return samples
+
+
+def bench_endpoint(base_url, clients, name, catalog, total_requests, warmup, seed):
+    """
+    This function issues `total_requests` requests to one endpoint, split evenly
+    across the clients, each client running closed-loop in its own thread.
+    It returns a summary with latency percentiles (ms), throughput and error count.
+    """
+    method, path, build = ENDPOINTS[name]
+    rng = random.Random(seed)
+    concurrency = len(clients)
+
+    warmup_jobs = [build(rng, catalog) for _ in range(warmup)]
+    _run_jobs(base_url, clients[0], method, path, warmup_jobs)
+
+    jobs = [build(rng, catalog) for _ in range(total_requests)]
+    chunks = [jobs[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(_run_jobs, base_url, client, method, path, chunk)
+            for client, chunk in zip(clients, chunks)
+        ]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    return {
+        "endpoint": name,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": sum(1 for _, ok in samples if not ok),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+    }
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+# Reporting
+
+
+def print_report(results):
+    header = f"{'endpoint':<32}{'conc':>5}{'reqs':>7}{'errs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+    print(header)
+    print("-" * len(header))
+    for result in results.values():
+        print(
+            f"{result['endpoint']:<32}{result['concurrency']:>5}{result['requests']:>7}"
+            f"{result['errors']:>6}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+            f"{result['p99_ms']:>10.1f}{result['throughput_rps']:>10.1f}"
+        )
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    This function compares each result with the baseline entry of the same key.
+    A result regresses when its p95 latency grows, or its throughput drops, by more
+    than `tolerance` (a fraction). It prints the deltas and returns the regressed keys.
+    """
+    regressions = []
+    print(f"\nComparison with baseline (tolerance {tolerance:.0%}):")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"  {key}: no baseline")
+            continue
+        p95_delta = _relative_change(result["p95_ms"], base["p95_ms"])
+        rps_delta = _relative_change(result["throughput_rps"], base["throughput_rps"])
+        regressed = p95_delta > tolerance or rps_delta < -tolerance
+        print(
+            f"  {key}: p95 {p95_delta:+.1%}, throughput {rps_delta:+.1%}"
+            + ("  REGRESSION" if regressed else "")
+        )
+        if regressed:
+            regressions.append(key)
+    return regressions
+
+
+def _relative_change(value, reference):
+    if reference == 0:
+        return 0.0
+    return (value - reference) / reference
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS)
+    )
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8])
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=200,
+        help="timed requests per endpoint and concurrency level",
+    )
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--playlist-size", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument(
+        "--server-url",
+        help="benchmark an already running server instead of starting one",
+    )
+    parser.add_argument(
+        "--no-seed", action="store_true", help="do not reseed the databases"
+    )
+    parser.add_argument("--feature-store", default="bench_feature_store")
+    parser.add_argument(
+        "--no-feature-store",
+        action="store_true",
+        help="serve song features from PostgreSQL instead of the feature store",
+    )
+    parser.add_argument("--postgres-host", default="localhost")
+    parser.add_argument("--postgres-port", default="5432")
+    parser.add_argument("--postgres-db", default="swiftydb")
+    parser.add_argument("--postgres-user", default="postgres")
+    parser.add_argument("--postgres-password", default="swiftydb")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--neo4j-uri", default="neo4j://localhost:7687")
+    parser.add_argument("--neo4j-user", default="neo4j")
+    parser.add_argument("--neo4j-password", default="swiftydb")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    catalog = load_chart_songs()
+    taylor_swift_songs = load_taylor_swift_songs()
+
+    if not args.no_seed:
+        conn = psycopg2.connect(
+            host=args.postgres_host,
+            port=args.postgres_port,
+            database=args.postgres_db,
+            options="-c search_path=project,public",
+            user=args.postgres_user,
+            password=args.postgres_password,
+        )
+        try:
+            seed_postgres(conn, catalog, taylor_swift_songs)
+            if not args.no_feature_store:
+                FeatureStore.build_from_postgres(conn).save(args.feature_store)
+        finally:
+            conn.close()
+        mongo_client = MongoClient(args.mongo_uri)
+        seed_mongo(mongo_client["MDB_Project"])
+        mongo_client.close()
+        driver = GraphDatabase.driver(
+            args.neo4j_uri, auth=(args.neo4j_user, args.neo4j_password)
+        )
+        try:
+            seed_neo4j(driver, taylor_swift_songs)
+        finally:
+            driver.close()
+
+    results = {}
+    with run_stub_spotify(catalog) as spotify_url:
+        env_overrides = {
+            "SPOTIFY_ACCOUNTS_URL": spotify_url,
+            "SPOTIFY_API_URL": spotify_url,
+            "POSTGRES_HOST": args.postgres_host,
+            "POSTGRES_PORT": args.postgres_port,
+            "POSTGRES_DB": args.postgres_db,
+            "MONGO_URI": args.mongo_uri,
+            "NEO4J_URI": args.neo4j_uri,
+            "NEO4J_USER": args.neo4j_user,
+            "NEO4J_PASSWORD": args.neo4j_password,
+        }
+        if not args.no_feature_store:
+            env_overrides["FEATURE_STORE_PATH"] = os.path.abspath(args.feature_store)
+        if args.server_url:
+            server = nullcontext(args.server_url)
+        else:
+            server = run_server(
+                args.port, env_overrides, args.postgres_user, args.postgres_password
+            )
+        with server as base_url:
+            rng = random.Random(args.seed)
+            for concurrency in args.concurrency:
+                clients = [
+                    make_client(base_url, rng.sample(catalog, args.playlist_size))
+                    for _ in range(concurrency)
+                ]
+                for name in args.endpoints:
+                    result = bench_endpoint(
+                        base_url,
+                        clients,
+                        name,
+                        catalog,
+                        args.requests,
+                        args.warmup,
+                        args.seed,
+                    )
+                    results[f"{name}@c{concurrency}"] = result
+                for client in clients:
+                    client.close()
+
+    print_report(results)
+    with open(args.output, "w") as file1:
+        json.dump(results, file1, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file1:
+            json.dump(results, file1, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file1:
+            baseline = json.load(file1)
+        if compare_to_baseline(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""Compact columnar store of the song catalog's audio features.
+
+The store is a directory of .npy arrays opened with numpy memory mapping, so
+every worker process shares one copy of the catalog through the page cache
+and loading it is near instant:
+
+    song_ids.npy        int64   (N,)    songs.song_id
+    name_idx.npy        int32   (N,)    index into the name table
+    artist_idx.npy      int32   (N,)    index into the artist table
+    release_dates.npy   datetime64[D] (N,)
+    features.npy        float32 (N, 9)  audio features, in FEATURES order
+    names_*.npy, artists_*.npy          interned string tables
+
+Rows are sorted by (name, release date), and string tables are sorted, so
+looking a song up is two binary searches and never builds a per-song dict.
+
+Build or refresh the store from PostgreSQL with:
+    python feature_store.py build [path]
+"""
+
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+FEATURES = [
+    "acousticness",
+    "danceability",
+    "energy",
+    "instrumentalness",
+    "liveness",
+    "loudness",
+    "speechiness",
+    "tempo",
+    "valence",
+]
+
+DEFAULT_PATH = os.environ.get("FEATURE_STORE_PATH", "feature_store")
+
+CATALOG_FILTER = "name IS NOT NULL AND release_date IS NOT NULL"
+CATALOG_QUERY = f"""
+SELECT song_id, name, artists, release_date, {", ".join(FEATURES)}
+FROM songs
+WHERE {CATALOG_FILTER};
+"""
+CATALOG_COUNT_QUERY = f"SELECT count(*) FROM songs WHERE {CATALOG_FILTER};"
+
+
+class StringTable:
+    """
+    Sorted, deduplicated strings stored as one UTF-8 buffer plus offsets.
+    Both arrays can be memory mapped; strings are only decoded when accessed.
+    """
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def from_sorted(cls, strings):
+        """`strings` must already be sorted and unique."""
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(offsets, blob)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i] : self.offsets[i + 1]]).decode("utf-8")
+
+    def index(self, string):
+        """Binary search; returns the position of `string` or -1 if absent."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle] < string:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self) and self[low] == string else -1
+
+    def save(self, path, prefix):
+        np.save(os.path.join(path, f"{prefix}_offsets.npy"), self.offsets)
+        np.save(os.path.join(path, f"{prefix}_blob.npy"), self.blob)
+
+    @classmethod
+    def load(cls, path, prefix, mmap_mode="r"):
+        return cls(
+            np.load(os.path.join(path, f"{prefix}_offsets.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, f"{prefix}_blob.npy"), mmap_mode=mmap_mode),
+        )
+
+
+def _sorted_strings(ids, idx):
+    """
+    This function turns strings numbered in order of appearance (`ids`: string -> id)
+    into a sorted StringTable, and renumbers `idx` to positions in that table.
+    """
+    strings = sorted(ids)
+    positions = np.empty(len(strings), dtype=np.int32)
+    positions[[ids[string] for string in strings]] = np.arange(len(strings))
+    return StringTable.from_sorted(strings), positions[idx]
+
+
+class FeatureStore:
+    """
+    Column arrays for the song catalog. Use FeatureStore.load() to open a
+    persisted store and FeatureStore.build() to create one from database rows.
+    """
+
+    def __init__(
+        self, song_ids, names, artists, name_idx, artist_idx, release_dates, features
+    ):
+        self.song_ids = song_ids
+        self.names = names
+        self.artists = artists
+        self.name_idx = name_idx
+        self.artist_idx = artist_idx
+        self.release_dates = release_dates
+        self.features = features
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    @classmethod
+    def build(cls, chunks, size=0):
+        """
+        This function builds an in-memory store from an iterable of row chunks (lists of
+        (song_id, name, artists, release_date, *features) rows, as returned by CATALOG_QUERY).
+        Rows are copied chunk by chunk into arrays preallocated for `size` rows (grown if
+        there are more), so only the distinct names and artists are kept as Python objects.
+        """
+        columns = {
+            "song_ids": np.empty(size, dtype=np.int64),
+            "name_idx": np.empty(size, dtype=np.int32),
+            "artist_idx": np.empty(size, dtype=np.int32),
+            "release_dates": np.empty(size, dtype="datetime64[D]"),
+            "features": np.empty((size, len(FEATURES)), dtype=np.float32),
+        }
+        # Strings get ids in order of appearance; they are renumbered in sorted order below
+        name_ids, artist_ids = {}, {}
+        filled = 0
+        for chunk in chunks:
+            stop = filled + len(chunk)
+            if stop > len(columns["song_ids"]):
+                capacity = max(stop, 2 * len(columns["song_ids"]))
+                for key, column in columns.items():
+                    columns[key] = np.resize(column, (capacity, *column.shape[1:]))
+            values = list(zip(*chunk))
+            columns["song_ids"][filled:stop] = values[0]
+            columns["name_idx"][filled:stop] = [
+                name_ids.setdefault(name or "", len(name_ids)) for name in values[1]
+            ]
+            columns["artist_idx"][filled:stop] = [
+                artist_ids.setdefault(artist or "", len(artist_ids))
+                for artist in values[2]
+            ]
+            columns["release_dates"][filled:stop] = values[3]
+            columns["features"][filled:stop] = np.array(values[4:], dtype=np.float32).T
+            filled = stop
+        columns = {key: column[:filled] for key, column in columns.items()}
+
+        names, name_idx = _sorted_strings(name_ids, columns["name_idx"])
+        artists, artist_idx = _sorted_strings(artist_ids, columns["artist_idx"])
+        dates = columns["release_dates"]
+        order = np.lexsort((dates, name_idx))
+        return cls(
+            song_ids=columns["song_ids"][order],
+            names=names,
+            artists=artists,
+            name_idx=name_idx[order],
+            artist_idx=artist_idx[order],
+            release_dates=dates[order],
+            features=columns["features"][order],
+        )
+
+    @classmethod
+    def build_from_postgres(cls, connection, batch_size=100_000):
+        """This function builds a store from the songs table, streaming rows with a server-side cursor."""
+        with connection.cursor() as cursor:
+            cursor.execute(CATALOG_COUNT_QUERY)
+            size = cursor.fetchone()[0]
+        with connection.cursor(name="feature_store") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(CATALOG_QUERY)
+            return cls.build(iter(lambda: cursor.fetchmany(batch_size), []), size)
+
+    def save(self, path):
+        """
+        This function writes the store to directory `path`. It is written next to
+        `path` first and swapped in afterwards, so readers never see a partial store.
+        Processes that already mapped the old files keep reading them until they reload.
+        """
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "song_ids.npy"), self.song_ids)
+        np.save(os.path.join(tmp_path, "name_idx.npy"), self.name_idx)
+        np.save(os.path.join(tmp_path, "artist_idx.npy"), self.artist_idx)
+        np.save(os.path.join(tmp_path, "release_dates.npy"), self.release_dates)
+        np.save(os.path.join(tmp_path, "features.npy"), self.features)
+        self.names.save(tmp_path, "names")
+        self.artists.save(tmp_path, "artists")
+        with open(os.path.join(tmp_path, "meta.json"), "w") as file1:
+            json.dump({"features": FEATURES, "songs": len(self)}, file1)
+
+        old_path = f"{path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH, mmap_mode="r"):
+        """This function opens a persisted store. With the default mmap_mode nothing is copied into memory."""
+        with open(os.path.join(path, "meta.json")) as file1:
+            meta = json.load(file1)
+        if meta["features"] != FEATURES:
+            raise ValueError(f"feature store at {path} has columns {meta['features']}")
+
+        def array(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        return cls(
+            song_ids=array("song_ids"),
+            names=StringTable.load(path, "names", mmap_mode),
+            artists=StringTable.load(path, "artists", mmap_mode),
+            name_idx=array("name_idx"),
+            artist_idx=array("artist_idx"),
+            release_dates=array("release_dates"),
+            features=array("features"),
+        )
+
+    def lookup(self, name, release_date=None, artists=None):
+        """
+        This function returns the row indices of the songs called `name`,
+        optionally restricted to one release date ("YYYY-MM-DD") and artists string.
+        """
+        key = self.names.index(name)
+        if key < 0:
+            return np.empty(0, dtype=np.int64)
+        # Same dtype as the column, or numpy copies the whole column to compare
+        bounds = np.array([key, key + 1], dtype=self.name_idx.dtype)
+        start, stop = np.searchsorted(self.name_idx, bounds)
+        if release_date is not None:
+            try:
+                date = np.datetime64(release_date, "D")
+            except ValueError:
+                return np.empty(0, dtype=np.int64)
+            dates = self.release_dates[start:stop]
+            start, stop = start + np.searchsorted(dates, [date, date + 1])
+        rows = np.arange(start, stop)
+        if artists is not None:
+            key = self.artists.index(artists)
+            rows = rows[self.artist_idx[rows] == key]
+        return rows
+
+    def song(self, row):
+        """This function returns one row as a dict shaped like a songs table row."""
+        song = {
+            "song_id": int(self.song_ids[row]),
+            "name": self.names[self.name_idx[row]],
+            "artists": self.artists[self.artist_idx[row]],
+            "release_date": str(self.release_dates[row]),
+        }
+        song.update(zip(FEATURES, self.features[row].tolist()))
+        return song
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] != "build":
+        print("usage: python feature_store.py build [path]")
+        return 2
+    path = argv[1] if len(argv) > 1 else DEFAULT_PATH
+
+    from server import create_connection
+
+    connection = create_connection()
+    if connection is None:
+        return 1
+    try:
+        store = FeatureStore.build_from_postgres(connection)
+    finally:
+        connection.close()
+    store.save(path)
+    print(f"Wrote {len(store)} songs to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
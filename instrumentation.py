@@ -0,0 +1,244 @@
+"""Request tracing, latency metrics and an opt-in sampling profiler.
+
+Wrap any slow call (database query, Spotify request, KMeans fit, ...) in
+`span("name")`. Every span is observed in a Prometheus histogram and, inside
+a Flask request, recorded on the request trace. The trace lives in a context
+variable, so work handed to a thread pool with `submit(executor, fn, ...)`
+is traced (and profiled) as part of the request too. `init_app(app)` adds:
+
+- a /metrics endpoint in the Prometheus text format
+- per-request latency histograms
+- a Server-Timing response header listing the spans of the request (for a
+  streamed response, the spans before its body)
+- a DEBUG log line per request with its spans; the latency histogram, the
+  log line and the profiler include the body of stream_with_context
+  responses
+- sampling profiling of a fraction of requests (PROFILE_SAMPLE_RATE)
+
+Environment variables:
+    LOG_LEVEL            logging level for the app (default INFO)
+    PROFILE_SAMPLE_RATE  fraction of requests to profile, 0 to 1 (default 0)
+    PROFILE_INTERVAL     seconds between profiler samples (default 0.005)
+"""
+
+import contextvars
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+SPAN_SECONDS = Histogram(
+    "swiftydb_span_seconds",
+    "Time spent in instrumented operations",
+    ["span"],
+    buckets=BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "swiftydb_request_seconds",
+    "Time spent handling HTTP requests",
+    ["method", "endpoint", "status"],
+    buckets=BUCKETS,
+)
+
+# Spans of the current request and its profiler, if it is being profiled
+_trace = contextvars.ContextVar("trace", default=None)
+_profiler = contextvars.ContextVar("profiler", default=None)
+
+
+def configure_logging():
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+@contextmanager
+def span(name):
+    """
+    This context manager times the enclosed block.
+    The duration is observed in the swiftydb_span_seconds histogram under `name`
+    and appended to the trace of the current request, if there is one.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.labels(span=name).observe(elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((name, elapsed))
+
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    This function submits `fn` to a thread pool inside a copy of the current context.
+    Spans in the worker are recorded on the trace of the submitting request, and the
+    worker thread is sampled by the request's profiler while it runs `fn`.
+    """
+    return executor.submit(
+        contextvars.copy_context().run, _run_profiled, fn, *args, **kwargs
+    )
+
+
+def _run_profiled(fn, *args, **kwargs):
+    profiler = _profiler.get()
+    if profiler is None:
+        return fn(*args, **kwargs)
+    thread_id = threading.get_ident()
+    profiler.add_thread(thread_id)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.remove_thread(thread_id)
+
+
+class SamplingProfiler:
+    """
+    Samples the call stacks of a set of threads (the request thread, plus any
+    worker threads added while they work for the request) every `interval`
+    seconds from a background thread and counts identical stacks. Cheap
+    enough to run on a live request, unlike a deterministic profiler.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_ids = {thread_id}
+        self.interval = interval
+        self.stacks = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def add_thread(self, thread_id):
+        with self._lock:
+            self.thread_ids.add(thread_id)
+
+    def remove_thread(self, thread_id):
+        with self._lock:
+            self.thread_ids.discard(thread_id)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                thread_ids = list(self.thread_ids)
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+                    )
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+def log_profile(path, stacks, top=10):
+    """Default profile hook: logs the most frequently sampled stacks of a request."""
+    total = sum(stacks.values())
+    lines = [f"Profile of {path}: {total} samples"]
+    for stack, count in stacks.most_common(top):
+        lines.append(f"  {count:>5} {stack}")
+    logger.info("\n".join(lines))
+
+
+def span_totals(trace):
+    """Sums repeated spans (e.g. one query per playlist song) by name: name -> (count, seconds)."""
+    totals = {}
+    for name, duration in trace:
+        count, total = totals.get(name, (0, 0.0))
+        totals[name] = (count + 1, total + duration)
+    return totals
+
+
+def init_app(app, profile_hook=log_profile):
+    """
+    This function installs the request hooks and the /metrics endpoint on a Flask app.
+    `profile_hook(path, stacks)` is called with the sampled stack counts of every
+    profiled request.
+    """
+    sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+    interval = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+
+    @app.before_request
+    def start_trace():
+        g.trace = []
+        _trace.set(g.trace)
+        g.request_start = time.perf_counter()
+        if sample_rate and random.random() < sample_rate:
+            g.profiler = SamplingProfiler(threading.get_ident(), interval)
+            _profiler.set(g.profiler)
+            g.profiler.start()
+
+    @app.after_request
+    def add_server_timing(response):
+        if "request_start" not in g:
+            return response
+        g.response_status = response.status_code
+        timings = [
+            f'{name};dur={total * 1000:.2f};desc="x{count}"'
+            for name, (count, total) in span_totals(g.trace).items()
+        ]
+        if not response.is_streamed:
+            elapsed = time.perf_counter() - g.request_start
+            timings.append(f"total;dur={elapsed * 1000:.2f}")
+        # Headers go out before a streamed body, so its spans cannot be listed
+        if timings:
+            response.headers["Server-Timing"] = ", ".join(timings)
+        return response
+
+    @app.teardown_request
+    def finish_trace(exception=None):
+        # Runs after the body of stream_with_context responses has been sent
+        if "request_start" in g:
+            elapsed = time.perf_counter() - g.request_start
+            status = g.get("response_status", 500)
+            REQUEST_SECONDS.labels(
+                method=request.method,
+                endpoint=request.url_rule.rule if request.url_rule else "unmatched",
+                status=status,
+            ).observe(elapsed)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "%s %s %s %.1fms %s",
+                    request.method,
+                    request.path,
+                    status,
+                    elapsed * 1000,
+                    " ".join(
+                        f"{name}={total * 1000:.1f}ms/{count}"
+                        for name, (count, total) in span_totals(g.trace).items()
+                    ),
+                )
+            if "profiler" in g:
+                profile_hook(request.path, g.profiler.stop())
+
+        # Server threads are reused; spans outside a request must not land here
+        _trace.set(None)
+        _profiler.set(None)
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,411 @@
+"""Micro-benchmarks and scaling curves for the recommendation math.
+
+Times the building blocks of the recommendation endpoints on synthetic data
+drawn from the feature distributions in taylor_swift_spotify.csv, across
+catalog sizes (for similarity search) and playlist sizes (for feature
+extraction and clustering). Runs fully offline:
+
+- playlist-features: get_playlist_songs_features on a playlist of dicts, the
+  PostgreSQL fallback for songs missing from the feature store
+- feature-store-lookup: FeatureStore.lookup by name and release date for every
+  playlist song, then one gather of their feature rows, as
+  get_playlist_features does, against a store of --store-size songs
+- kmeans: cluster_songs (KMeans, 3 clusters) on the playlist feature matrix
+- kmeans-process: the same fit through a warm spawn process pool, as
+  playlist_pipeline.py runs large playlists; the gap to kmeans is the cost
+  of the round trip
+- cosine-similarity: the brute-force cosine top-1 scan that
+  send_song_to_neo4j_and_get_similar asks Neo4j to perform, for 3 centroids
+- sql-ranking: SIMILARITY_QUERY from recommendation.py executed against an
+  in-memory SQLite copy of ts_table
+
+With --neo4j-uri, send_song_to_neo4j_and_get_similar itself is also timed
+against a live Neo4j (with the GDS plugin) seeded with the synthetic catalog.
+This replaces every :Song node in that database.
+
+For every size the wall time (best of --repeat runs) and a memory figure are
+reported. The "memory" column says what was measured:
+
+- python-heap: peak Python heap allocation of one run (tracemalloc, which
+  includes NumPy buffers)
+- sqlite-db: size of the in-memory SQLite database (page_count * page_size)
+- neo4j-heap: JVM heap in use on the Neo4j server after one run
+
+Once a case takes longer than --max-seconds, larger sizes of that benchmark
+are skipped: that is where the approach stops being viable.
+
+Example:
+    python microbenchmark.py --catalog-sizes 1000 100000 10000000 --output curves.csv
+"""
+
+import argparse
+import csv
+import datetime
+import multiprocessing
+import sqlite3
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from neo4j import GraphDatabase
+
+from benchmark import FEATURES, load_taylor_swift_songs
+from feature_store import FeatureStore
+from neo4j_playlist_similarity import (
+    cluster_songs,
+    get_playlist_songs_features,
+    send_song_to_neo4j_and_get_similar,
+)
+from recommendation import SIMILARITY_QUERY
+
+CATALOG_SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+PLAYLIST_SIZES = [3, 30, 300, 5_000]
+NUM_CLUSTERS = 3
+
+
+class FeatureDistribution:
+    """
+    Multivariate normal fitted to the nine audio features of the Taylor Swift
+    dataset, clipped to the observed range of each feature.
+    """
+
+    def __init__(self, songs):
+        matrix = np.array([[song[feature] for feature in FEATURES] for song in songs])
+        self.mean = matrix.mean(axis=0)
+        self.cov = np.cov(matrix, rowvar=False)
+        self.low = matrix.min(axis=0)
+        self.high = matrix.max(axis=0)
+
+    def sample(self, n, rng):
+        samples = rng.multivariate_normal(self.mean, self.cov, size=n)
+        return np.clip(samples, self.low, self.high, out=samples)
+
+
+def cosine_top1(catalog, vector):
+    """
+    Offline equivalent of the Cypher query in send_song_to_neo4j_and_get_similar:
+    the index and cosine similarity of the catalog row closest to `vector`.
+    """
+    norms = np.linalg.norm(catalog, axis=1) * np.linalg.norm(vector)
+    similarity = catalog @ vector / norms
+    best = int(np.argmax(similarity))
+    return best, similarity[best]
+
+
+def make_sqlite_ts_table(distribution, size, rng, chunk_size=100_000):
+    """
+    This function builds an in-memory SQLite ts_table of `size` synthetic songs.
+    Rows are sampled and inserted in chunks so the catalog is never held in Python at once.
+    """
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("SELECT pow(2, 3)")
+    except sqlite3.OperationalError:
+        # SQLite built without its math functions; a Python callback is much slower
+        conn.create_function("POW", 2, lambda base, exp: base**exp, deterministic=True)
+    columns = ", ".join(f"{feature} REAL" for feature in FEATURES)
+    conn.execute(f"CREATE TABLE ts_table (name TEXT, {columns})")
+    placeholders = ", ".join("?" * (len(FEATURES) + 1))
+    for start in range(0, size, chunk_size):
+        chunk = distribution.sample(min(chunk_size, size - start), rng)
+        conn.executemany(
+            f"INSERT INTO ts_table VALUES ({placeholders})",
+            ((f"song {start + i}", *row) for i, row in enumerate(chunk.tolist())),
+        )
+    return conn
+
+
+def make_feature_store(distribution, size, rng, chunk_size=100_000):
+    """
+    This function builds a FeatureStore of `size` synthetic songs, released over ten years,
+    feeding FeatureStore.build in chunks the way build_from_postgres does.
+    """
+    first_day = datetime.date(2010, 1, 1)
+
+    def chunks():
+        for start in range(0, size, chunk_size):
+            features = distribution.sample(min(chunk_size, size - start), rng)
+            yield [
+                (
+                    start + i,
+                    f"song {start + i}",
+                    "artist",
+                    first_day + datetime.timedelta(days=(start + i) % 3650),
+                    *row,
+                )
+                for i, row in enumerate(features.tolist())
+            ]
+
+    return FeatureStore.build(chunks(), size)
+
+
+def sqlite_database_mib(conn):
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size / 2**20
+
+
+def neo4j_heap_mib(driver):
+    with driver.session() as session:
+        record = session.run(
+            'CALL dbms.queryJmx("java.lang:type=Memory") YIELD attributes '
+            "RETURN attributes.HeapMemoryUsage.value.properties.used AS used"
+        ).single()
+    return record["used"] / 2**20
+
+
+def seed_neo4j_catalog(driver, catalog, batch_size=50_000):
+    with driver.session() as session:
+        session.run(
+            "MATCH (song:Song) CALL { WITH song DETACH DELETE song } IN TRANSACTIONS"
+        )
+        for start in range(0, len(catalog), batch_size):
+            rows = [
+                dict(zip(FEATURES, row), name=f"song {start + i}")
+                for i, row in enumerate(catalog[start : start + batch_size].tolist())
+            ]
+            session.run(
+                "UNWIND $rows AS row CREATE (song:Song) SET song = row", rows=rows
+            )
+
+
+# Each case builder takes (size, distribution, rng, args) and returns a
+# zero-argument callable to time, an optional cleanup callable and an
+# optional callable returning the memory used outside the Python heap, in MiB.
+
+
+def playlist_features_case(size, distribution, rng, args):
+    playlist = [
+        dict(zip(FEATURES, row)) for row in distribution.sample(size, rng).tolist()
+    ]
+    return lambda: get_playlist_songs_features(playlist), None, None
+
+
+_feature_stores = {}
+
+
+def feature_store_lookup_case(size, distribution, rng, args):
+    if args.store_size not in _feature_stores:
+        # Built once and shared by every playlist size
+        _feature_stores[args.store_size] = make_feature_store(
+            distribution, args.store_size, np.random.default_rng(args.seed)
+        )
+    store = _feature_stores[args.store_size]
+    playlist = [
+        store.song(row) for row in rng.integers(0, len(store), size=size).tolist()
+    ]
+
+    def run():
+        matches = [
+            store.lookup(song["name"], song["release_date"]) for song in playlist
+        ]
+        return store.features[np.concatenate(matches)]
+
+    return run, None, None
+
+
+def kmeans_case(size, distribution, rng, args):
+    features = distribution.sample(size, rng)
+    return lambda: cluster_songs(features, min(NUM_CLUSTERS, size)), None, None
+
+
+def kmeans_process_case(size, distribution, rng, args):
+    features = distribution.sample(size, rng)
+    pool = ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    )
+    # Spawn the worker and import scikit-learn before timing
+    pool.submit(cluster_songs, features[:NUM_CLUSTERS], 1).result()
+
+    def run():
+        return pool.submit(cluster_songs, features, min(NUM_CLUSTERS, size)).result()
+
+    return run, pool.shutdown, None
+
+
+def cosine_similarity_case(size, distribution, rng, args):
+    catalog = distribution.sample(size, rng)
+    centroids = distribution.sample(NUM_CLUSTERS, rng)
+    return (
+        lambda: [cosine_top1(catalog, centroid) for centroid in centroids],
+        None,
+        None,
+    )
+
+
+def sql_ranking_case(size, distribution, rng, args):
+    conn = make_sqlite_ts_table(distribution, size, rng)
+    query = SIMILARITY_QUERY.replace("%s", "?")
+    user_params = distribution.sample(1, rng)[0].tolist()
+    return (
+        lambda: conn.execute(query, user_params).fetchall(),
+        conn.close,
+        lambda: sqlite_database_mib(conn),
+    )
+
+
+def neo4j_similarity_case(size, distribution, rng, args):
+    driver = GraphDatabase.driver(
+        args.neo4j_uri, auth=(args.neo4j_user, args.neo4j_password)
+    )
+    seed_neo4j_catalog(driver, distribution.sample(size, rng))
+    centroids = distribution.sample(NUM_CLUSTERS, rng).tolist()
+
+    def run():
+        return [
+            send_song_to_neo4j_and_get_similar(driver, centroid)
+            for centroid in centroids
+        ]
+
+    return run, driver.close, lambda: neo4j_heap_mib(driver)
+
+
+# Benchmark name -> (case builder, size axis, what its memory figure measures).
+# SQLite and Neo4j allocate outside the Python heap, where tracemalloc cannot see.
+BENCHMARKS = {
+    "playlist-features": (playlist_features_case, "playlist", "python-heap"),
+    "feature-store-lookup": (feature_store_lookup_case, "playlist", "python-heap"),
+    "kmeans": (kmeans_case, "playlist", "python-heap"),
+    "kmeans-process": (kmeans_process_case, "playlist", "python-heap"),
+    "cosine-similarity": (cosine_similarity_case, "catalog", "python-heap"),
+    "sql-ranking": (sql_ranking_case, "catalog", "sqlite-db"),
+    "neo4j-similarity": (neo4j_similarity_case, "catalog", "neo4j-heap"),
+}
+
+
+def measure(run, repeat, memory=None):
+    """
+    This function returns the best wall time over `repeat` runs, in seconds,
+    and the memory used by one extra run, in MiB: the peak traced heap allocation,
+    or what `memory()` reports after the run when it is given.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    if memory is not None:
+        run()
+        return min(timings), memory()
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(timings), peak / 2**20
+
+
+def run_benchmark(name, sizes, distribution, args):
+    """
+    This function runs one benchmark across increasing sizes and returns a row per size.
+    Sizes after the first one slower than args.max_seconds are reported as skipped.
+    """
+    build, _, memory_source = BENCHMARKS[name]
+    rows = []
+    too_slow = False
+    for size in sorted(sizes):
+        row = {
+            "benchmark": name,
+            "size": size,
+            "seconds": None,
+            "memory_mib": None,
+            "memory": memory_source,
+        }
+        if too_slow:
+            row["status"] = "skipped"
+        else:
+            rng = np.random.default_rng(args.seed)
+            run, cleanup, memory = build(size, distribution, rng, args)
+            try:
+                row["seconds"], row["memory_mib"] = measure(run, args.repeat, memory)
+            finally:
+                if cleanup is not None:
+                    cleanup()
+            row["status"] = "ok"
+            too_slow = row["seconds"] > args.max_seconds
+        rows.append(row)
+        print_row(row)
+    return rows
+
+
+def print_row(row):
+    if row["status"] == "skipped":
+        print(f"{row['benchmark']:<20}{row['size']:>12,}{'skipped':>14}")
+    else:
+        print(
+            f"{row['benchmark']:<20}{row['size']:>12,}"
+            f"{row['seconds'] * 1000:>12.2f}ms{row['memory_mib']:>12.1f}MiB"
+            f"  {row['memory']}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        choices=list(BENCHMARKS),
+        default=[name for name in BENCHMARKS if name != "neo4j-similarity"],
+    )
+    parser.add_argument("--catalog-sizes", nargs="+", type=int, default=CATALOG_SIZES)
+    parser.add_argument("--playlist-sizes", nargs="+", type=int, default=PLAYLIST_SIZES)
+    parser.add_argument(
+        "--store-size",
+        type=int,
+        default=1_000_000,
+        help="songs in the synthetic feature store of feature-store-lookup",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=30.0,
+        help="skip larger sizes of a benchmark once one run takes longer than this",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the scaling curves to this CSV file")
+    parser.add_argument(
+        "--neo4j-uri", help="also time the real Neo4j query (replaces all :Song nodes)"
+    )
+    parser.add_argument("--neo4j-user", default="neo4j")
+    parser.add_argument("--neo4j-password", default="swiftydb")
+    args = parser.parse_args(argv)
+
+    benchmarks = list(args.benchmarks)
+    if args.neo4j_uri and "neo4j-similarity" not in benchmarks:
+        benchmarks.append("neo4j-similarity")
+    elif not args.neo4j_uri and "neo4j-similarity" in benchmarks:
+        parser.error("neo4j-similarity requires --neo4j-uri")
+
+    distribution = FeatureDistribution(load_taylor_swift_songs())
+    print(f"{'benchmark':<20}{'size':>12}{'time':>14}{'memory':>15}")
+    rows = []
+    for name in benchmarks:
+        axis = BENCHMARKS[name][1]
+        sizes = args.playlist_sizes if axis == "playlist" else args.catalog_sizes
+        rows.extend(run_benchmark(name, sizes, distribution, args))
+
+    if args.output:
+        with open(args.output, "w", newline="") as file1:
+            writer = csv.DictWriter(
+                file1,
+                fieldnames=[
+                    "benchmark",
+                    "size",
+                    "seconds",
+                    "memory_mib",
+                    "memory",
+                    "status",
+                ],
+            )
+            writer.writeheader()
+            writer.writerows(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
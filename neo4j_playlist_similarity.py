@@ -1,9 +1,11 @@
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, Query
 from sklearn.cluster import KMeans
 import numpy as np
 
+from instrumentation import span
 
-def send_song_to_neo4j_and_get_similar(driver, song_features):
+
+def send_song_to_neo4j_and_get_similar(driver, song_features, timeout=None):
     # Adjust the Cypher query for GDS
     query = """
     WITH $new_song_features AS new_song_features
@@ -16,16 +18,19 @@ def send_song_to_neo4j_and_get_similar(driver, song_features):
     LIMIT 1
     """
 
-    # Execute the query
-    with driver.session() as session:
-        result = session.run(query, new_song_features=song_features)
+    # Execute the query; with a timeout (in seconds) the server aborts it once exceeded
+    with span("neo4j.similar_song"), driver.session() as session:
+        result = session.run(
+            Query(query, timeout=timeout), new_song_features=song_features
+        )
         records = [record for record in result]
         return records
 
 
 def cluster_songs(song_features, num_clusters=3):
     # Cluster the songs
-    kmeans = KMeans(n_clusters=num_clusters, random_state=0).fit(song_features)
+    with span("kmeans.fit"):
+        kmeans = KMeans(n_clusters=num_clusters, random_state=0).fit(song_features)
     centroids = kmeans.cluster_centers_
     return centroids
 
@@ -52,9 +57,12 @@ def get_playlist_songs_features(playlist_songs: list[dict]):
 def find_songs_for_playlist(driver, playlist_songs: list[dict], n: int):
     # Get features of playlist songs
     features = get_playlist_songs_features(playlist_songs)
+    return find_songs_for_features(driver, np.array(features), n)
+
 
+def find_songs_for_features(driver, features: np.ndarray, n: int):
     # Perform clustering
-    centroids = cluster_songs(np.array(features), n)
+    centroids = cluster_songs(features, n)
 
     # Find similar songs for each centroid
     recommended_songs = []
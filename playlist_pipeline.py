@@ -0,0 +1,253 @@
+"""Concurrent pipeline behind /api/get-taylor-swift-playlist.
+
+The playlist recommendation runs in three stages under one end-to-end
+deadline:
+
+1. features: load the playlist's audio features (MongoDB, feature store,
+   PostgreSQL) on the feature thread pool
+2. clustering: KMeans on the features; playlists of at least
+   KMEANS_PROCESS_THRESHOLD songs are clustered in a process pool so the
+   fit does not hold the GIL of the web server
+3. similarity: one Neo4j query per centroid, run concurrently on the Neo4j
+   thread pool. Each query gets the remaining budget as its transaction
+   timeout, so Neo4j aborts queries that outlive the deadline instead of
+   letting them occupy the server and a pool thread.
+
+Each stage has its own bounded pool, so slow feature loads cannot starve
+the similarity queries of other requests (and vice versa). Work is
+submitted with instrumentation.submit, so its spans land on the request
+trace and profiled requests sample the worker threads as well.
+
+When a stage runs out of time the pipeline returns what it has: if
+clustering is late, evenly spaced playlist songs stand in for the
+centroids; if some similarity queries are late, only the finished ones are
+returned. Stages that ran out of time are reported to the caller.
+
+The KMeans worker processes take a few seconds to spawn and import
+scikit-learn, so the server starts them in the background when it starts
+serving (start_process_pool). A pool whose worker died is replaced, and
+the fit that hit it is redone in a thread.
+
+KMEANS_PROCESS_THRESHOLD is an untuned default. The process pool never
+makes a fit faster: compare the kmeans and kmeans-process curves of
+microbenchmark.py, which time a fit in-thread and through a warm worker
+process. Its only benefit is keeping the Python parts of the fit off the
+web server's GIL, which those benchmarks do not measure.
+
+Environment variables:
+    PLAYLIST_DEADLINE_SECONDS  end-to-end budget per request (default 5)
+    KMEANS_PROCESS_THRESHOLD   playlist size from which KMeans runs in a
+                               separate process (default 5000)
+    KMEANS_PROCESSES           size of that process pool (default 2)
+    KMEANS_THREADS             size of the in-thread KMeans pool (default 4)
+    FEATURE_LOAD_THREADS       size of the feature loading pool (default 8)
+    NEO4J_QUERY_THREADS        size of the similarity thread pool (default 8)
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    TimeoutError,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from neo4j.exceptions import ClientError
+
+from instrumentation import span, submit
+from neo4j_playlist_similarity import cluster_songs, send_song_to_neo4j_and_get_similar
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_SECONDS = float(os.environ.get("PLAYLIST_DEADLINE_SECONDS", "5"))
+KMEANS_PROCESS_THRESHOLD = int(os.environ.get("KMEANS_PROCESS_THRESHOLD", "5000"))
+KMEANS_PROCESSES = int(os.environ.get("KMEANS_PROCESSES", "2"))
+KMEANS_THREADS = int(os.environ.get("KMEANS_THREADS", "4"))
+FEATURE_LOAD_THREADS = int(os.environ.get("FEATURE_LOAD_THREADS", "8"))
+NEO4J_QUERY_THREADS = int(os.environ.get("NEO4J_QUERY_THREADS", "8"))
+
+# Shared by all requests; the pools bound the concurrency of the whole server
+_feature_pool = ThreadPoolExecutor(
+    max_workers=FEATURE_LOAD_THREADS, thread_name_prefix="playlist-features"
+)
+_kmeans_pool = ThreadPoolExecutor(
+    max_workers=KMEANS_THREADS, thread_name_prefix="playlist-kmeans"
+)
+_neo4j_pool = ThreadPoolExecutor(
+    max_workers=NEO4J_QUERY_THREADS, thread_name_prefix="playlist-neo4j"
+)
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """This function returns the KMeans process pool, creating it if start_process_pool was not called."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: forking a multi-threaded web server is unsafe
+            _process_pool = ProcessPoolExecutor(
+                max_workers=KMEANS_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def discard_process_pool(pool):
+    """This function drops a broken process pool, so the next large playlist starts a new one."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start_process_pool():
+    """
+    This function starts the KMeans worker processes in the background, so the first
+    large playlist does not pay for spawning them and importing scikit-learn.
+    It returns without waiting for the workers to be ready.
+    """
+    pool = get_process_pool()
+    for _ in range(KMEANS_PROCESSES):
+        pool.submit(os.getpid)
+
+
+class Deadline:
+    """A point in time after which the pipeline stops waiting for its stages."""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+def fallback_centroids(features, n):
+    """Evenly spaced playlist songs, used as centroids when clustering is late."""
+    return features[
+        np.linspace(0, len(features) - 1, min(n, len(features))).astype(int)
+    ]
+
+
+def cluster_with_deadline(features, n, deadline):
+    """
+    This function returns the KMeans centroids of `features`, or None if they
+    are not ready before the deadline. Large playlists are clustered in the process pool.
+    """
+    n = min(n, len(features))
+    with span("pipeline.clustering"):
+        if len(features) >= KMEANS_PROCESS_THRESHOLD:
+            pool = get_process_pool()
+            try:
+                future = pool.submit(cluster_songs, features, n)
+                return wait_for_centroids(future, deadline)
+            except BrokenProcessPool:
+                logger.error("KMeans process pool is broken; starting a new one")
+                discard_process_pool(pool)
+        future = submit(_kmeans_pool, cluster_songs, features, n)
+        return wait_for_centroids(future, deadline)
+
+
+def wait_for_centroids(future, deadline):
+    try:
+        return future.result(timeout=deadline.remaining())
+    except TimeoutError:
+        future.cancel()
+        return None
+
+
+def query_with_deadline(driver, centroid, deadline):
+    """
+    This function runs one similarity query with the remaining budget as its Neo4j
+    transaction timeout. It returns None, without records, if the budget ran out
+    before or while the query ran.
+    """
+    timeout = deadline.remaining()
+    if timeout <= 0:
+        # A timeout of 0 would mean no timeout at all
+        return None
+    try:
+        return send_song_to_neo4j_and_get_similar(driver, centroid, timeout=timeout)
+    except ClientError as e:
+        if e.code and e.code.startswith(
+            "Neo.ClientError.Transaction.TransactionTimedOut"
+        ):
+            return None
+        raise
+
+
+def find_similar_with_deadline(driver, centroids, deadline):
+    """
+    This function runs one Neo4j similarity query per centroid concurrently.
+    It returns the records of the queries that finished before the deadline,
+    in centroid order, and whether any query was late.
+    """
+    futures = [
+        submit(_neo4j_pool, query_with_deadline, driver, centroid, deadline)
+        for centroid in centroids
+    ]
+    with span("pipeline.similarity"):
+        done, not_done = wait(
+            futures, timeout=deadline.remaining(), return_when=FIRST_EXCEPTION
+        )
+    # Queued queries are dropped; running ones are aborted by their Neo4j timeout
+    for future in not_done:
+        future.cancel()
+
+    records = []
+    late = bool(not_done)
+    for future in futures:
+        if future in done:
+            # Re-raises the first query error, as the sequential version did
+            result = future.result()
+            if result is None:
+                late = True
+            else:
+                records.extend(result)
+    return records, late
+
+
+def run_playlist_pipeline(load_features, driver, n=3, deadline_seconds=None):
+    """
+    This function runs the recommendation pipeline for one playlist.
+    `load_features` is a zero-argument callable returning the playlist's (N x 9)
+    feature matrix. It runs on a worker thread in a copy of the caller's context,
+    so its spans are recorded on the caller's request trace.
+    It returns the Neo4j records of the recommended songs and the list of stages
+    that ran out of time (empty when the result is complete).
+    """
+    deadline = Deadline(
+        DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+    )
+    late_stages = []
+
+    future = submit(_feature_pool, load_features)
+    try:
+        with span("pipeline.features"):
+            features = future.result(timeout=deadline.remaining())
+    except TimeoutError:
+        future.cancel()
+        logger.warning("Playlist features not loaded within the deadline")
+        return [], ["features"]
+    if not len(features):
+        return [], late_stages
+
+    centroids = cluster_with_deadline(features, n, deadline)
+    if centroids is None:
+        logger.warning("Clustering %d songs exceeded the deadline", len(features))
+        late_stages.append("clustering")
+        centroids = fallback_centroids(features, n)
+
+    records, similarity_late = find_similar_with_deadline(driver, centroids, deadline)
+    if similarity_late:
+        logger.warning("Some similarity queries exceeded the deadline")
+        late_stages.append("similarity")
+    return records, late_stages
@@ -5,6 +5,45 @@ You will need to create a file called `credentials.txt` in the same directory as
 DO NOT COMMIT `credentials.txt` TO GITHUB."""
 
 
+# Rank Taylor Swift songs by squared euclidean distance to one song's features
+SIMILARITY_QUERY = """
+SELECT 
+    grouped.name,
+    (
+        POW((%s - grouped.avg_acousticness), 2) +
+        POW((%s - grouped.avg_danceability), 2) +
+        POW((%s - grouped.avg_energy), 2) +
+        POW((%s - grouped.avg_instrumentalness), 2) +
+        POW((%s - grouped.avg_liveness), 2) +
+        POW((%s - grouped.avg_loudness), 2) +
+        POW((%s - grouped.avg_speechiness), 2) +
+        POW((%s - grouped.avg_tempo), 2) +
+        POW((%s - grouped.avg_valence), 2)
+    ) AS similarity
+FROM 
+    (
+        SELECT 
+            name,
+            AVG(acousticness) AS avg_acousticness,
+            AVG(danceability) AS avg_danceability,
+            AVG(energy) AS avg_energy,
+            AVG(instrumentalness) AS avg_instrumentalness,
+            AVG(liveness) AS avg_liveness,
+            AVG(loudness) AS avg_loudness,
+            AVG(speechiness) AS avg_speechiness,
+            AVG(tempo) AS avg_tempo,
+            AVG(valence) AS avg_valence
+        FROM 
+            ts_table
+        GROUP BY 
+            name
+    ) AS grouped
+ORDER BY 
+    similarity ASC
+LIMIT 3;
+    """
+
+
 def credentials():
     file1 = open('credentials.txt', 'r')
     lines = file1.readlines()
@@ -52,43 +91,7 @@ def recommend_taylor_swift_songs(connection, user_song):
     cursor.execute(query, (user_song[0], user_song[1], user_song[2]))
     user_params = cursor.fetchone()  # Fetch the result of the query
 
-    query = """
-SELECT 
-    grouped.name,
-    (
-        POW((%s - grouped.avg_acousticness), 2) +
-        POW((%s - grouped.avg_danceability), 2) +
-        POW((%s - grouped.avg_energy), 2) +
-        POW((%s - grouped.avg_instrumentalness), 2) +
-        POW((%s - grouped.avg_liveness), 2) +
-        POW((%s - grouped.avg_loudness), 2) +
-        POW((%s - grouped.avg_speechiness), 2) +
-        POW((%s - grouped.avg_tempo), 2) +
-        POW((%s - grouped.avg_valence), 2)
-    ) AS similarity
-FROM 
-    (
-        SELECT 
-            name,
-            AVG(acousticness) AS avg_acousticness,
-            AVG(danceability) AS avg_danceability,
-            AVG(energy) AS avg_energy,
-            AVG(instrumentalness) AS avg_instrumentalness,
-            AVG(liveness) AS avg_liveness,
-            AVG(loudness) AS avg_loudness,
-            AVG(speechiness) AS avg_speechiness,
-            AVG(tempo) AS avg_tempo,
-            AVG(valence) AS avg_valence
-        FROM 
-            ts_table
-        GROUP BY 
-            name
-    ) AS grouped
-ORDER BY 
-    similarity ASC
-LIMIT 3;
-    """
-    cursor.execute(query, user_params)
+    cursor.execute(SIMILARITY_QUERY, user_params)
     return cursor.fetchall()
 
 
@@ -0,0 +1,152 @@
+"""Background job that precomputes playlist recommendations.
+
+Every playlist change bumps the user's playlist version and flags their
+recommendations as pending (see mark_playlist_modified in server.py), which
+makes them due for a refresh. Stored recommendations become due again after
+RECOMMENDATION_TTL_SECONDS, so catalog and feature store updates reach users
+whose playlist did not change. Expired recommendations are only refreshed for
+active users, who read them or changed their playlist within
+ACTIVE_USER_SECONDS; the others are retired until the user comes back, when
+the endpoint recomputes them on demand.
+
+This job picks up due recommendations, the longest due first, recomputes them
+in batches and stores them, so that /api/get-taylor-swift-playlist can answer
+returning users with a single key lookup. The playlists of a batch are read
+with a single MongoDB query. Results are only stored if the playlist version did not change
+while they were computed; otherwise the user stays due for the next run.
+
+Run it next to the server:
+    python refresh_recommendations.py --interval 60
+or once, e.g. from cron:
+    python refresh_recommendations.py --once
+"""
+
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING
+
+from server import (
+    ACTIVE_USER_SECONDS,
+    compute_playlist_recommendations,
+    create_indexes_with_retry,
+    get_playlist_songs_for_users,
+    recommendation_collection,
+    store_recommendations,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def retire_inactive(now):
+    """
+    This function stops refreshing the expired recommendations of users that were not seen
+    within ACTIVE_USER_SECONDS, by removing their refresh_at. Pending recommendations stay due.
+    It returns the number of users retired.
+    """
+    active_since = now - timedelta(seconds=ACTIVE_USER_SECONDS)
+    result = recommendation_collection.update_many(
+        {
+            "refresh_at": {"$lte": now},
+            "pending": False,
+            "$or": [
+                {"accessed_at": {"$lt": active_since}},
+                {"accessed_at": {"$exists": False}},
+            ],
+        },
+        {"$unset": {"refresh_at": ""}},
+    )
+    return result.modified_count
+
+
+def refresh_due(batch_size=100, max_batches=None):
+    """
+    This function recomputes the recommendations that are due (pending or expired), `batch_size` users
+    at a time. Users are visited in (refresh_at, _id) order, seeking past the last user of the previous
+    batch, so a user whose pipeline ran out of time stays due without being retried in the same call.
+    Users that become due while the call runs are left for the next one, and inactive users
+    are retired first (see retire_inactive).
+    It returns the number of users whose recommendations were stored.
+    """
+    refreshed = 0
+    batches = 0
+    now = datetime.now(timezone.utc)
+    retired = retire_inactive(now)
+    if retired:
+        logger.info("Retired the recommendations of %d inactive users", retired)
+    due = {"$lte": now}
+    query = {"refresh_at": due}
+    while max_batches is None or batches < max_batches:
+        batch = list(
+            recommendation_collection.find(query, {"version": 1, "refresh_at": 1})
+            .sort([("refresh_at", ASCENDING), ("_id", ASCENDING)])
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+        batches += 1
+        last = batch[-1]
+        query = {
+            "refresh_at": due,
+            "$or": [
+                {"refresh_at": {"$gt": last["refresh_at"]}},
+                {"refresh_at": last["refresh_at"], "_id": {"$gt": last["_id"]}},
+            ],
+        }
+
+        start = time.perf_counter()
+        stored = 0
+        playlists = get_playlist_songs_for_users([state["_id"] for state in batch])
+        for state in batch:
+            try:
+                recommendations, late_stages = compute_playlist_recommendations(
+                    state["_id"], playlists[state["_id"]]
+                )
+            except Exception:
+                logger.exception("Recommendations for %s failed", state["_id"])
+                continue
+            if late_stages:
+                logger.warning(
+                    "Recommendations for %s ran out of time in %s",
+                    state["_id"],
+                    ", ".join(late_stages),
+                )
+                continue
+            store_recommendations(state["_id"], state["version"], recommendations)
+            stored += 1
+        refreshed += stored
+        logger.info(
+            "Refreshed %d of %d playlists in %.1fs",
+            stored,
+            len(batch),
+            time.perf_counter() - start,
+        )
+    return refreshed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--max-batches", type=int, help="stop a run after this many batches"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=60, help="seconds between runs"
+    )
+    parser.add_argument("--once", action="store_true", help="run once and exit")
+    args = parser.parse_args(argv)
+
+    create_indexes_with_retry()
+    while True:
+        refreshed = refresh_due(args.batch_size, args.max_batches)
+        logger.info("Run finished: %d playlists refreshed", refreshed)
+        if args.once:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
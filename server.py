@@ -1,33 +1,83 @@
 import json
+import logging
 import os
-from datetime import datetime
-
-from flask import Flask, request, jsonify, render_template, session
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import (
+    Flask,
+    Response,
+    request,
+    jsonify,
+    render_template,
+    session,
+    stream_with_context,
+)
 from flask_cors import CORS  # Import CORS
 import psycopg2
 import requests
 import base64
+import numpy as np
 import config as cfg
-from pymongo import MongoClient
+from bson import ObjectId
+from pymongo import ASCENDING, MongoClient, ReturnDocument
+from pymongo.errors import PyMongoError
 from neo4j import GraphDatabase
-from neo4j_playlist_similarity import find_songs_for_playlist
+from neo4j_playlist_similarity import get_playlist_songs_features
+from playlist_pipeline import run_playlist_pipeline, start_process_pool
+from feature_store import FEATURES, FeatureStore
+from recommendation import SIMILARITY_QUERY
+from instrumentation import configure_logging, init_app, span
 
 # Spotify API credentials
 CLIENT_ID = cfg.client_id
 CLIENT_SECRET = cfg.client_secret
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for the Flask app
 app.secret_key = os.urandom(24)  # Or set a static secret key
+init_app(app)  # Request tracing, /metrics and the optional profiler
+
+# Service locations can be overridden from the environment (see benchmark.py)
+SPOTIFY_ACCOUNTS_URL = os.environ.get(
+    "SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com"
+)
+SPOTIFY_API_URL = os.environ.get("SPOTIFY_API_URL", "https://api.spotify.com")
+
+postgres_host = os.environ.get("POSTGRES_HOST", "s-l112.engr.uiowa.edu")
+postgres_port = os.environ.get("POSTGRES_PORT", "5432")
+postgres_database = os.environ.get("POSTGRES_DB", "mdb_student26")
 
-mongo_client = MongoClient("mongodb://localhost:27017/")
+mongo_client = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/"))
 db = mongo_client["MDB_Project"]
 playlist_collection = db["playlists"]
+# One document per user: playlist version, pending flag and precomputed recommendations
+recommendation_collection = db["playlist_recommendations"]
+# Stored recommendations are recomputed after this long, even if the playlist did not change
+RECOMMENDATION_TTL_SECONDS = float(
+    os.environ.get("RECOMMENDATION_TTL_SECONDS", "86400")
+)
+# Only users seen within this long get expired recommendations refreshed ahead of time
+ACTIVE_USER_SECONDS = float(os.environ.get("ACTIVE_USER_SECONDS", str(7 * 86400)))
+# accessed_at is rewritten at most this often per user, so reads rarely cost a write
+ACCESS_TIME_RESOLUTION_SECONDS = 3600
+MAX_PLAYLIST_PAGE_SIZE = 1000
+background_tasks_started = False
+background_tasks_lock = threading.Lock()
 
 # neo4j connection
-newo4j_uri = "neo4j://localhost:7687"
-newo4j_user = "neo4j"
-newo4j_password = "swiftydb"
+newo4j_uri = os.environ.get("NEO4J_URI", "neo4j://localhost:7687")
+newo4j_user = os.environ.get("NEO4J_USER", "neo4j")
+newo4j_password = os.environ.get("NEO4J_PASSWORD", "swiftydb")
+neo4j_driver = None
+
+# Columnar song features, memory mapped and shared by all workers (see feature_store.py)
+feature_store_path = os.environ.get("FEATURE_STORE_PATH", "feature_store")
+feature_store = None
 
 
 def credentials():
@@ -49,24 +99,109 @@ def create_connection():
     It first retrieves the username and password from the credentials function.
     Then, it tries to establish a connection to the database using these credentials.
     If the connection is successful, it returns the connection object.
-    If there is an error during the connection, it prints the error and returns None.
+    If there is an error during the connection, it logs the error and returns None.
     """
     username, password = credentials()
     try:
-        conn = psycopg2.connect(
-            host="s-l112.engr.uiowa.edu",
-            port="5432",
-            database="mdb_student26",
-            options="-c search_path=project,public",
-            user=username,
-            password=password,
-        )
+        with span("postgres.connect"):
+            conn = psycopg2.connect(
+                host=postgres_host,
+                port=postgres_port,
+                database=postgres_database,
+                options="-c search_path=project,public",
+                user=username,
+                password=password,
+            )
         return conn
     except (Exception, psycopg2.DatabaseError) as e:
-        print(f"The error '{e}' occurred")
+        logger.error("The error '%s' occurred", e)
         return None
 
 
+def get_feature_store():
+    """
+    This function returns the feature store, loading it on first use.
+    If no store has been built yet, it returns None and callers fall back to PostgreSQL.
+    """
+    global feature_store
+    if feature_store is None and os.path.exists(
+        os.path.join(feature_store_path, "meta.json")
+    ):
+        feature_store = FeatureStore.load(feature_store_path)
+    return feature_store
+
+
+def get_neo4j_driver():
+    """
+    This function returns the Neo4j driver shared by all requests, creating it on first use.
+    The driver keeps a connection pool and is safe to use from several threads.
+    """
+    global neo4j_driver
+    if neo4j_driver is None:
+        neo4j_driver = GraphDatabase.driver(
+            newo4j_uri, auth=(newo4j_user, newo4j_password)
+        )
+    return neo4j_driver
+
+
+def create_indexes():
+    """
+    This function creates the MongoDB indexes the queries rely on.
+    create_index is idempotent, so every process can run it at startup.
+    """
+    # Serves playlist reads and the _id seek used for pagination
+    playlist_collection.create_index([("user_id", ASCENDING), ("_id", ASCENDING)])
+    # Lets refresh_recommendations.py find due recommendations without a collection scan
+    recommendation_collection.create_index(
+        [("refresh_at", ASCENDING), ("_id", ASCENDING)]
+    )
+
+
+def create_indexes_with_retry(max_delay=60):
+    """
+    This function creates the MongoDB indexes, retrying with exponential backoff
+    (up to `max_delay` seconds between attempts) while MongoDB is unreachable.
+    """
+    delay = 1
+    while True:
+        try:
+            create_indexes()
+            return
+        except PyMongoError as e:
+            logger.warning(
+                "Could not create MongoDB indexes, retrying in %ds: %s", delay, e
+            )
+            time.sleep(delay)
+            delay = min(2 * delay, max_delay)
+
+
+def start_background_tasks():
+    """
+    This function starts the per-process startup work on background threads, once:
+    MongoDB index creation, and spawning the KMeans worker processes so the first
+    large playlist does not pay for it. It does no I/O itself, so requests never
+    wait for it, and a MongoDB outage only affects the MongoDB endpoints.
+    """
+    global background_tasks_started
+    with background_tasks_lock:
+        if background_tasks_started:
+            return
+        background_tasks_started = True
+    threading.Thread(
+        target=create_indexes_with_retry, name="mongo-indexes", daemon=True
+    ).start()
+    threading.Thread(
+        target=start_process_pool, name="kmeans-processes", daemon=True
+    ).start()
+
+
+@app.before_request
+def start_background_tasks_once():
+    # Under a WSGI server there is no entry point of ours, so start on the first request
+    if not background_tasks_started:
+        start_background_tasks()
+
+
 @app.route("/")
 def index():
     if session.get("user_id") is None:
@@ -95,19 +230,20 @@ def search_songs():
         artist_name = request.args.get("artist")
         cursor = connection.cursor()
         query = "SELECT name, artists, release_date FROM songs WHERE name ILIKE %s and artists ILIKE %s LIMIT 5;"
-        cursor.execute(
-            query,
-            (
-                "%" + song_name + "%",
-                "%" + artist_name + "%",
-            ),
-        )
-        songs = cursor.fetchall()
+        with span("postgres.search_songs"):
+            cursor.execute(
+                query,
+                (
+                    "%" + song_name + "%",
+                    "%" + artist_name + "%",
+                ),
+            )
+            songs = cursor.fetchall()
         cursor.close()
         connection.close()
         return jsonify(songs)
     else:
-        print("Error in the connection")
+        logger.error("Error in the connection")
         return jsonify([])
 
 
@@ -125,48 +261,22 @@ def recommend_taylor_swift_songs():
         cursor = connection.cursor()
         query = """Select acousticness, danceability, energy, instrumentalness, liveness, loudness, speechiness, tempo, valence
     FROM songs  WHERE name = %s AND artists = %s AND release_date = %s;"""
-        cursor.execute(query, (user_song[0], user_song[1], user_song[2]))
-        user_params = cursor.fetchone()
-
-        query = """
-SELECT 
-    grouped.name,
-    (
-        POW((%s - grouped.avg_acousticness), 2) +
-        POW((%s - grouped.avg_danceability), 2) +
-        POW((%s - grouped.avg_energy), 2) +
-        POW((%s - grouped.avg_instrumentalness), 2) +
-        POW((%s - grouped.avg_liveness), 2) +
-        POW((%s - grouped.avg_loudness), 2) +
-        POW((%s - grouped.avg_speechiness), 2) +
-        POW((%s - grouped.avg_tempo), 2) +
-        POW((%s - grouped.avg_valence), 2)
-    ) AS similarity
-FROM 
-    (
-        SELECT 
-            name,
-            AVG(acousticness) AS avg_acousticness,
-            AVG(danceability) AS avg_danceability,
-            AVG(energy) AS avg_energy,
-            AVG(instrumentalness) AS avg_instrumentalness,
-            AVG(liveness) AS avg_liveness,
-            AVG(loudness) AS avg_loudness,
-            AVG(speechiness) AS avg_speechiness,
-            AVG(tempo) AS avg_tempo,
-            AVG(valence) AS avg_valence
-        FROM 
-            ts_table
-        GROUP BY 
-            name
-    ) AS grouped
-ORDER BY 
-    similarity ASC
-LIMIT 3;
-    """
-        cursor.execute(query, user_params)
-        recommendations = cursor.fetchall()
-        print(recommendations, "recommendations")
+        store = get_feature_store()
+        rows = []
+        if store is not None:
+            # The frontend sends the release date as formatted by jsonify
+            rows = store.lookup(user_song[0], convert_date(user_song[2]), user_song[1])
+        if len(rows):
+            user_params = tuple(store.features[rows[0]].tolist())
+        else:
+            with span("postgres.song_features"):
+                cursor.execute(query, (user_song[0], user_song[1], user_song[2]))
+                user_params = cursor.fetchone()
+
+        with span("postgres.similarity_ranking"):
+            cursor.execute(SIMILARITY_QUERY, user_params)
+            recommendations = cursor.fetchall()
+        logger.debug("Recommendations: %s", recommendations)
         cursor.close()
         connection.close()
         return jsonify(recommendations)
@@ -195,10 +305,10 @@ def get_spotify_token():
 
     data = {"grant_type": "client_credentials"}
 
-    response = requests.post(
-        "https://accounts.spotify.com/api/token", headers=headers, data=data
-    )
-    # print(response.json(), "response")
+    with span("spotify.token"):
+        response = requests.post(
+            f"{SPOTIFY_ACCOUNTS_URL}/api/token", headers=headers, data=data
+        )
     return response.json().get("access_token")
 
 
@@ -225,10 +335,10 @@ def search_spotify():
         ("limit", "5"),
     )
 
-    response = requests.get(
-        "https://api.spotify.com/v1/search", headers=headers, params=params
-    )
-    # print(response.json(), " :response from spotify")
+    with span("spotify.search"):
+        response = requests.get(
+            f"{SPOTIFY_API_URL}/v1/search", headers=headers, params=params
+        )
     tracks = response.json().get("tracks", {}).get("items", [])
     songs = []
     for track in tracks:
@@ -251,16 +361,17 @@ def add_spotify_song():
     The function then adds these audio features to the song data and inserts the song into the PostgreSQL database.
     """
     song = request.json
-    print(song, "song")
+    logger.debug("Adding Spotify song: %s", song)
     song_id = song.get("id")  # Assuming the song ID is included in the JSON
     headers = {
         "Authorization": f"Bearer {get_spotify_token()}",
     }
 
     # Get audio features for the song
-    audio_features_response = requests.get(
-        f"https://api.spotify.com/v1/audio-features/{song_id}", headers=headers
-    )
+    with span("spotify.audio_features"):
+        audio_features_response = requests.get(
+            f"{SPOTIFY_API_URL}/v1/audio-features/{song_id}", headers=headers
+        )
     audio_features = audio_features_response.json()
 
     # Add audio features to the song data
@@ -300,25 +411,26 @@ def add_spotify_song():
         cursor = connection.cursor()
         query = """INSERT INTO songs (name, artists, release_date, acousticness, danceability, energy, instrumentalness, liveness, loudness, speechiness, tempo, valence, duration_ms)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);"""
-        cursor.execute(
-            query,
-            (
-                song_good["name"],
-                str(song_good["artists"]).strip("['']"),
-                song_good["release_date"],
-                song_good["acousticness"],
-                song_good["danceability"],
-                song_good["energy"],
-                song_good["instrumentalness"],
-                song_good["liveness"],
-                song_good["loudness"],
-                song_good["speechiness"],
-                song_good["tempo"],
-                song_good["valence"],
-                song_good["duration_ms"],
-            ),
-        )
-        connection.commit()
+        with span("postgres.insert_song"):
+            cursor.execute(
+                query,
+                (
+                    song_good["name"],
+                    str(song_good["artists"]).strip("['']"),
+                    song_good["release_date"],
+                    song_good["acousticness"],
+                    song_good["danceability"],
+                    song_good["energy"],
+                    song_good["instrumentalness"],
+                    song_good["liveness"],
+                    song_good["loudness"],
+                    song_good["speechiness"],
+                    song_good["tempo"],
+                    song_good["valence"],
+                    song_good["duration_ms"],
+                ),
+            )
+            connection.commit()
         cursor.close()
         connection.close()
         return jsonify(song_good)
@@ -353,18 +465,21 @@ def add_to_playlist():
         song_data["user_id"] = session["user_id"]
 
         # Check if the song already exists for this user
-        existing_song = playlist_collection.find_one(
-            {
-                "name": song_data["name"],
-                "artists": song_data["artists"],
-                "release_date": song_data["release_date"],
-                "user_id": song_data["user_id"],
-            }
-        )
+        with span("mongo.find_song"):
+            existing_song = playlist_collection.find_one(
+                {
+                    "name": song_data["name"],
+                    "artists": song_data["artists"],
+                    "release_date": song_data["release_date"],
+                    "user_id": song_data["user_id"],
+                }
+            )
 
         if not existing_song:
-            playlist_collection.insert_one(song_data)
-            print(f"Added song to playlist: {song_data}")
+            with span("mongo.insert_song"):
+                playlist_collection.insert_one(song_data)
+            mark_playlist_modified(song_data["user_id"])
+            logger.debug("Added song to playlist: %s", song_data)
             return jsonify({"message": "Song added to playlist"})
         else:
             return jsonify({"message": "Song already in playlist"})
@@ -389,51 +504,112 @@ def get_playlist():
     """
     This function handles the GET request at the /api/get-playlist endpoint.
     It checks if a user session exists. If not, it returns an empty list.
-    If a user session exists, it retrieves the user_id from the session.
-    It then retrieves the user's playlist from the MongoDB database.
-    It then retrieves the song data from the PostgreSQL database.
-    It then returns a JSON list of songs in the user's playlist.
+    If a user session exists, it retrieves the user's playlist from the MongoDB database, ordered by _id.
+    Songs are streamed straight from the MongoDB cursor, so the playlist is never held in memory:
+    - by default as a JSON list, sent in chunks
+    - with "format=ndjson", as newline-delimited JSON, one song per line
+    With a "limit" query parameter it instead returns one page as
+    {"songs": [...], "next": token}. Pass the token as "after" to get the next page;
+    "next" is null on the last page. "after" also works with the streaming formats.
     """
 
+    stream_format = request.args.get("format", "json")
+    if stream_format not in ("json", "ndjson"):
+        return jsonify({"error": "format must be json or ndjson"}), 400
+    after = request.args.get("after")
+    if after is not None and not ObjectId.is_valid(after):
+        return jsonify({"error": "Invalid after token"}), 400
+    limit = request.args.get("limit", type=int)
+    if "limit" in request.args and (limit is None or limit < 1):
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    if limit:
+        limit = min(limit, MAX_PLAYLIST_PAGE_SIZE)
+
     if "user_id" not in session:
-        return jsonify([])  # Return an empty list if there is no user_id in the session
+        # Return an empty list if there is no user_id in the session
+        return jsonify({"songs": [], "next": None} if limit else [])
+
+    query = {"user_id": session["user_id"]}
+    if after is not None:
+        # Seek past the last song of the previous page instead of skipping
+        query["_id"] = {"$gt": ObjectId(after)}
+    songs = playlist_collection.find(query).sort("_id", ASCENDING)
+
+    if limit:
+        with span("mongo.playlist"):
+            # One extra song tells whether there is a next page
+            page = list(songs.limit(limit + 1))
+        next_token = None
+        if len(page) > limit:
+            page.pop()
+            next_token = str(page[-1]["_id"])
+        for song in page:
+            song["_id"] = str(song["_id"])  # Convert ObjectId to string
+        logger.debug("Playlist page: %s", page)
+        return jsonify({"songs": page, "next": next_token})
+
+    if stream_format == "ndjson":
+        return Response(
+            stream_with_context(stream_playlist_ndjson(songs)),
+            mimetype="application/x-ndjson",
+        )
+    return Response(
+        stream_with_context(stream_playlist_json(songs)), mimetype="application/json"
+    )
 
-    user_id = session["user_id"]
-    songs = playlist_collection.find({"user_id": user_id})
-    # Convert MongoDB cursor to list and serialize ObjectId to JSON
-    songs_list = []
-    for song in songs:
-        song["_id"] = str(song["_id"])  # Convert ObjectId to string
-        songs_list.append(song)
 
-    print(f"Converted to list: {songs_list}")
+def stream_playlist_ndjson(songs):
+    # The span also covers the time the client takes to read the stream
+    with span("mongo.playlist"):
+        for song in songs:
+            song["_id"] = str(song["_id"])  # Convert ObjectId to string
+            yield app.json.dumps(song) + "\n"
+
 
-    return jsonify(songs_list)
+def stream_playlist_json(songs):
+    yield "["
+    separator = ""
+    with span("mongo.playlist"):
+        for song in songs:
+            song["_id"] = str(song["_id"])  # Convert ObjectId to string
+            yield separator + app.json.dumps(song)
+            separator = ","
+    yield "]"
 
 
-def get_all_playlist_songs_in_postgresql():
+def get_playlist_songs_from_mongodb(user_id):
     """
-    This function retrieves all songs from the user's playlist in MongoDB and checks if they exist in the PostgreSQL database.
-    It first checks if the user is logged in by checking if "user_id" is in the session.
-    If the user is not logged in, it returns an empty list.
-    If the user is logged in, it retrieves the user's playlist from MongoDB and checks each song in the PostgreSQL database.
-    It returns a list of all songs in the user's playlist that exist in the PostgreSQL database.
+    This function retrieves the name, artists and release date of every song in the user's playlist in MongoDB.
     """
-    if "user_id" not in session:
-        return jsonify([])  # Return an empty list if there is no user_id in the session
+    songs = playlist_collection.find(
+        {"user_id": user_id}, {"_id": 0, "name": 1, "artists": 1, "release_date": 1}
+    )
+    with span("mongo.playlist"):
+        return list(songs)
 
-    user_id = session["user_id"]
-    songs = playlist_collection.find({"user_id": user_id})
-
-    list_of_songs = []
-    for song in songs:
-        songs_dict = {
-            "name": song["name"],
-            "artists": song["artists"],
-            "release_date": song["release_date"],
-        }
-        list_of_songs.append(songs_dict)
 
+def get_playlist_songs_for_users(user_ids):
+    """
+    This function retrieves the playlists of several users with a single MongoDB query.
+    It returns a dict from user id to the name, artists and release date of every song in their playlist.
+    """
+    songs = playlist_collection.find(
+        {"user_id": {"$in": list(user_ids)}},
+        {"_id": 0, "user_id": 1, "name": 1, "artists": 1, "release_date": 1},
+    )
+    playlists = {user_id: [] for user_id in user_ids}
+    with span("mongo.playlists"):
+        for song in songs:
+            playlists[song.pop("user_id")].append(song)
+    return playlists
+
+
+def get_all_playlist_songs_in_postgresql(list_of_songs):
+    """
+    This function checks if the given playlist songs exist in the PostgreSQL database.
+    It returns a list of all matching songs in the PostgreSQL database, one dict per row.
+    If there is an error in the connection, it returns None.
+    """
     all_songs = []
     connection = create_connection()
     if connection:
@@ -446,8 +622,9 @@ def get_all_playlist_songs_in_postgresql():
                 FROM songs
                 WHERE name = %s AND release_date = %s;
                 """
-                cursor.execute(query, (song["name"], song["release_date"]))
-                songs = cursor.fetchall()
+                with span("postgres.playlist_song"):
+                    cursor.execute(query, (song["name"], song["release_date"]))
+                    songs = cursor.fetchall()
 
                 for song in songs:
                     song_dict = {
@@ -474,10 +651,44 @@ def get_all_playlist_songs_in_postgresql():
 
         return all_songs
     else:
-        print("Error in the connection")
+        logger.error("Error in the connection")
         return None
 
 
+def get_playlist_features(user_id):
+    """
+    This function returns the audio features of the songs in the user's playlist as a float32 (N x 9) matrix.
+    """
+    return get_songs_features(get_playlist_songs_from_mongodb(user_id))
+
+
+def get_songs_features(list_of_songs):
+    """
+    This function returns the audio features of the given playlist songs as a float32 (N x 9) matrix.
+    Songs are looked up in the feature store when one is available.
+    Songs missing from it (e.g. added from Spotify since it was built) are looked up in the PostgreSQL database.
+    """
+    features = np.empty((0, len(FEATURES)), dtype=np.float32)
+    missing = list_of_songs
+    store = get_feature_store()
+    if store is not None and list_of_songs:
+        with span("feature_store.lookup"):
+            matches = [
+                store.lookup(song["name"], song["release_date"])
+                for song in list_of_songs
+            ]
+        features = store.features[np.concatenate(matches)]
+        missing = [song for song, rows in zip(list_of_songs, matches) if not len(rows)]
+
+    if missing:
+        songs = get_all_playlist_songs_in_postgresql(missing)
+        if songs:
+            features = np.concatenate(
+                [features, np.array(get_playlist_songs_features(songs), np.float32)]
+            )
+    return features
+
+
 @app.route("/api/delete-from-playlist", methods=["POST"])
 def delete_from_playlist():
     """
@@ -497,16 +708,18 @@ def delete_from_playlist():
         song_data = request.get_json()
         user_id = session["user_id"]
 
-        result = playlist_collection.delete_one(
-            {
-                "name": song_data["name"],
-                "artists": song_data["artists"],
-                "release_date": song_data["release_date"],
-                "user_id": user_id,
-            }
-        )
+        with span("mongo.delete_song"):
+            result = playlist_collection.delete_one(
+                {
+                    "name": song_data["name"],
+                    "artists": song_data["artists"],
+                    "release_date": song_data["release_date"],
+                    "user_id": user_id,
+                }
+            )
 
         if result.deleted_count > 0:
+            mark_playlist_modified(user_id)
             return jsonify({"message": "Song deleted from playlist"})
         else:
             return jsonify({"message": "Song not found in playlist"})
@@ -515,28 +728,134 @@ def delete_from_playlist():
         return jsonify({"error": str(e)}), 500
 
 
+def mark_playlist_modified(user_id):
+    """
+    This function records that the user's playlist changed: it bumps the playlist version
+    and flags the stored recommendations as pending until they are recomputed.
+    They are due for a refresh from now on. It returns the updated state document.
+    """
+    now = datetime.now(timezone.utc)
+    with span("mongo.mark_playlist_modified"):
+        return recommendation_collection.find_one_and_update(
+            {"_id": user_id},
+            {
+                "$inc": {"version": 1},
+                "$set": {
+                    "pending": True,
+                    "modified_at": now,
+                    "refresh_at": now,
+                    "accessed_at": now,
+                },
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+
+def store_recommendations(user_id, version, recommendations):
+    """
+    This function stores recommendations computed for the given playlist version.
+    They are due for a refresh again after RECOMMENDATION_TTL_SECONDS, so catalog changes reach them.
+    If the playlist changed again in the meantime, nothing is stored and it stays pending.
+    """
+    now = datetime.now(timezone.utc)
+    with span("mongo.store_recommendations"):
+        recommendation_collection.update_one(
+            {"_id": user_id, "version": version},
+            {
+                "$set": {
+                    "recommendations": recommendations,
+                    "pending": False,
+                    "computed_at": now,
+                    "refresh_at": now + timedelta(seconds=RECOMMENDATION_TTL_SECONDS),
+                }
+            },
+        )
+
+
+def recommendations_due(state):
+    """
+    This function tells whether the recommendations of a state document must be recomputed:
+    the playlist changed since they were computed, or they are older than the TTL.
+    """
+    if state["pending"] or "refresh_at" not in state:
+        return True
+    # PyMongo returns naive datetimes in UTC
+    refresh_at = state["refresh_at"].replace(tzinfo=timezone.utc)
+    return refresh_at <= datetime.now(timezone.utc)
+
+
+def record_access(state):
+    """
+    This function records that the user read their recommendations, so refresh_recommendations.py
+    keeps them fresh. It writes at most once per ACCESS_TIME_RESOLUTION_SECONDS.
+    """
+    now = datetime.now(timezone.utc)
+    accessed_at = state.get("accessed_at")
+    stale_before = now - timedelta(seconds=ACCESS_TIME_RESOLUTION_SECONDS)
+    # PyMongo returns naive datetimes in UTC
+    if accessed_at is None or accessed_at.replace(tzinfo=timezone.utc) <= stale_before:
+        with span("mongo.record_access"):
+            recommendation_collection.update_one(
+                {"_id": state["_id"]}, {"$set": {"accessed_at": now}}
+            )
+
+
+def compute_playlist_recommendations(user_id, playlist_songs=None):
+    """
+    This function runs the playlist pipeline (see playlist_pipeline.py) for a user: it loads the features of
+    the user's playlist, clusters them and queries Neo4j for the closest Taylor Swift song to each centroid.
+    Pass `playlist_songs` if the playlist was already read from MongoDB (see get_playlist_songs_for_users).
+    It returns the list of recommendations and the list of pipeline stages that ran out of time.
+    """
+
+    def load_features():
+        if playlist_songs is None:
+            return get_playlist_features(user_id)
+        return get_songs_features(playlist_songs)
+
+    records, late_stages = run_playlist_pipeline(load_features, get_neo4j_driver(), 3)
+    return [{"name": record["name"]} for record in records], late_stages
+
+
 @app.route("/api/get-taylor-swift-playlist", methods=["GET"])
 def get_taylor_swift_playlist():
     """
     This function handles the GET request at the /api/get-taylor-swift-playlist endpoint.
-    It connects to the Neo4j database and retrieves all songs from the user's playlist in PostgreSQL.
-    It then prints the playlist songs and checks if there are any songs in the playlist.
-    If there are songs, it finds songs for the playlist and returns a JSON list of Taylor Swift playlist recommendations.
-    If there are no songs, it returns an empty JSON list.
-    """
-    driver = GraphDatabase.driver(newo4j_uri, auth=(newo4j_user, newo4j_password))
-    songs = get_all_playlist_songs_in_postgresql()
-    print("\nPlaylist songs:\n", songs)
-    if songs:
-        tswift_playlist_recommendations_raw = find_songs_for_playlist(driver, songs, 3)
-        tswift_playlist_recommendations = [
-            {"name": record["name"]} for record in tswift_playlist_recommendations_raw
-        ]
-        print("\nTaylor Playlist Recommendations:\n", tswift_playlist_recommendations)
-        return jsonify(tswift_playlist_recommendations)
-    else:
+    If the user's recommendations were precomputed (see refresh_recommendations.py), the playlist
+    has not changed since and they have not expired, it returns them with a single key lookup.
+    Otherwise it computes them on demand, stores them and returns a JSON list of Taylor Swift playlist recommendations.
+    If the pipeline ran out of time, the list is partial, it is not stored,
+    and the X-Partial-Result header names the late stages.
+    """
+    if "user_id" not in session:
         return jsonify([])
 
+    user_id = session["user_id"]
+    with span("mongo.recommendations"):
+        state = recommendation_collection.find_one({"_id": user_id})
+    if state is not None:
+        record_access(state)
+        if not recommendations_due(state):
+            return jsonify(state["recommendations"])
+
+    if state is None:
+        # Playlist created before recommendations were stored
+        state = mark_playlist_modified(user_id)
+    tswift_playlist_recommendations, late_stages = compute_playlist_recommendations(
+        user_id
+    )
+    logger.debug("Taylor Playlist Recommendations: %s", tswift_playlist_recommendations)
+    response = jsonify(tswift_playlist_recommendations)
+    if late_stages:
+        # Some stages ran out of time and the recommendations are partial
+        response.headers["X-Partial-Result"] = ",".join(late_stages)
+    else:
+        store_recommendations(
+            user_id, state["version"], tswift_playlist_recommendations
+        )
+    return response
+
 
 if __name__ == "__main__":
     app.run(debug=True, port=5002, host="0.0.0.0")
@@ -178,19 +178,45 @@ function getTaylorSwiftRecommendations(song) {
         .catch((error) => console.error("Error:", error));
 }
 
+const PLAYLIST_PAGE_SIZE = 100;
+let playlistLoadId = 0;
+
 /**
  * Loads the user's playlist from the server and displays it in the #playlist element.
+ * The playlist is fetched one page at a time and each page is rendered as soon as it arrives,
+ * so large playlists start showing immediately.
  * Each song is displayed with a checkbox and a label containing the song name and artist(s).
  * The value of each checkbox is the JSON string representation of the song object.
  */
 
 function loadPlaylist() {
-    fetch("/api/get-playlist")
+    const playlistElement = document.getElementById("playlist");
+    playlistElement.innerHTML = ""; // Clear current playlist
+    playlistLoadId += 1;
+    loadPlaylistPage(playlistElement, playlistLoadId, null, 0);
+}
+
+/**
+ * Fetches one page of the playlist, appends its songs to the #playlist element
+ * and then fetches the next page, until the server returns no next token.
+ *
+ * @param {HTMLElement} playlistElement - The element the songs are appended to.
+ * @param {number} loadId - The load this page belongs to; pages of an outdated load are dropped.
+ * @param {?string} after - The token of the previous page, or null for the first page.
+ * @param {number} index - The number of songs already displayed.
+ */
+function loadPlaylistPage(playlistElement, loadId, after, index) {
+    let url = `/api/get-playlist?limit=${PLAYLIST_PAGE_SIZE}`;
+    if (after) {
+        url += `&after=${encodeURIComponent(after)}`;
+    }
+    fetch(url)
         .then((response) => response.json())
-        .then((songs) => {
-            const playlistElement = document.getElementById("playlist");
-            playlistElement.innerHTML = ""; // Clear current playlist
-            songs.forEach((song, index) => {
+        .then((page) => {
+            if (loadId !== playlistLoadId) {
+                return; // The playlist was reloaded in the meantime
+            }
+            page.songs.forEach((song) => {
                 const listItem = document.createElement("li");
 
                 const checkbox = document.createElement("input");
@@ -205,7 +231,11 @@ function loadPlaylist() {
                 listItem.appendChild(checkbox);
                 listItem.appendChild(label);
                 playlistElement.appendChild(listItem);
+                index += 1;
             });
+            if (page.next) {
+                loadPlaylistPage(playlistElement, loadId, page.next, index);
+            }
         })
         .catch((error) => console.error("Error:", error));
 }